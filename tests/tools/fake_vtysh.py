@@ -0,0 +1,73 @@
+"""
+Just enough of vtysh for test_frr_reload.py.  The interactive mode reads its
+input through readline, as vtysh does, so that the echo frr-reload.py reads
+back looks the same.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import sys
+
+libc = ctypes.CDLL(None)
+readline = ctypes.CDLL(ctypes.util.find_library('readline'))
+readline.readline.argtypes = [ctypes.c_char_p]
+readline.readline.restype = ctypes.c_void_p
+
+
+def interactive():
+    prompt = 'frr# '
+
+    while True:
+        buf = readline.readline(prompt)
+
+        if not buf:
+            break
+
+        line = ctypes.string_at(buf).strip()
+        libc.free(ctypes.c_void_p(buf))
+
+        if line == 'configure terminal':
+            prompt = 'frr(config)# '
+        elif line.startswith('router '):
+            prompt = 'frr(config-router)# '
+        elif line == 'end':
+            prompt = 'frr# '
+        elif line == 'frr-reload-sync' or line.startswith('bogus'):
+            sys.stdout.write('%% Unknown command: %s\n' % line)
+
+        sys.stdout.flush()
+
+
+def show_running():
+    """
+    Print the file in FAKE_VTYSH_RUNNING
+    """
+    sys.stdout.write('Building configuration...\n\nCurrent configuration:\n')
+
+    with open(os.environ['FAKE_VTYSH_RUNNING']) as f:
+        for line in f:
+            sys.stdout.write(line)
+
+
+def mark():
+    """
+    vtysh -m -f - stops at the first line it does not know
+    """
+    for (lineno, line) in enumerate(sys.stdin, 1):
+        if line.startswith('bogus'):
+            sys.stdout.write('line %d: %% Unknown command[%d]: %s' % (lineno, lineno, line))
+            sys.exit(2)
+
+        sys.stdout.write(line)
+
+    sys.stdout.write('end\n')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['-c', 'show running-config']:
+        show_running()
+    elif sys.argv[1:] == ['-m', '-f', '-']:
+        mark()
+    else:
+        interactive()
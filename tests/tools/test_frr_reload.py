@@ -0,0 +1,207 @@
+import ctypes.util
+import imp
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+if sys.version_info[0] != 2:
+    pytest.skip('frr-reload.py is a python 2 script', allow_module_level=True)
+
+pytest.importorskip('ipaddr')
+
+frr_reload = imp.load_source(
+    'frr_reload',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'tools', 'frr-reload.py'))
+
+fake_vtysh_py = os.path.join(os.path.dirname(__file__), 'fake_vtysh.py')
+
+# vtysh -m -f frr.conf
+marked_file = '''frr version 5.0
+frr defaults traditional
+hostname r1
+!
+interface swp1
+ ip ospf network point-to-point
+!
+end
+line vty
+!
+
+end
+'''
+
+# vtysh -c 'show running-config' | tail -n +4 | vtysh -m -f -
+marked_running = '''!
+frr version 5.0
+frr defaults traditional
+hostname r1
+!
+interface swp1
+ ip ospf network point-to-point
+!
+end
+line vty
+!
+
+end
+'''
+
+
+def make_config(text):
+    config = frr_reload.Config()
+    config.lines = [line.strip() for line in text.splitlines()]
+    config.load_digest()
+    config.load_contexts()
+    return config
+
+
+def test_digest_same_config():
+    newconf = make_config(marked_file)
+    running = make_config(marked_running)
+
+    assert newconf.digest == running.digest
+    assert frr_reload.compare_context_objects(newconf, running) == ([], [])
+
+
+def test_digest_changed_config():
+    newconf = make_config(marked_file.replace('hostname r1', 'hostname r2'))
+    running = make_config(marked_running)
+
+    assert newconf.digest != running.digest
+
+
+def test_digest_ignores_final_end():
+    newconf = make_config(marked_file)
+    running = make_config(marked_file.rstrip().rsplit('\n', 1)[0])
+
+    assert newconf.digest == running.digest
+
+
+@pytest.fixture
+def fake_vtysh(monkeypatch):
+    """
+    Run fake_vtysh.py wherever frr-reload.py runs /usr/bin/vtysh
+    """
+    if not ctypes.util.find_library('readline'):
+        pytest.skip('fake_vtysh.py needs libreadline')
+
+    popen = subprocess.Popen
+
+    def fake_popen(args, *popenargs, **kwargs):
+        if args[0] == '/usr/bin/vtysh':
+            args = [sys.executable, fake_vtysh_py] + args[1:]
+        return popen(args, *popenargs, **kwargs)
+
+    monkeypatch.setattr(subprocess, 'Popen', fake_popen)
+
+
+def test_vtysh_long_commands(fake_vtysh):
+    # prompt plus command is wider than the 80 columns readline assumes
+    # when stdin is not a tty
+    ctx_key = 'router bgp 4200000000 vrf customer-vrf-with-a-fairly-long-name-here'
+    cmd = 'no neighbor 2001:db8:ffff:ffff:ffff:ffff:ffff:1 route-map customer-import-policy in'
+
+    vtysh = frr_reload.Vtysh()
+    try:
+        assert vtysh.configure([ctx_key, cmd]) == (frr_reload.Vtysh.SUCCESS, '')
+        assert vtysh.configure([ctx_key, 'bogus ' + cmd])[0] == frr_reload.Vtysh.SYNTAX_ERROR
+    finally:
+        vtysh.close()
+
+
+def load_from_show_running(tmpdir, monkeypatch, running):
+    """
+    Return the Config that load_from_show_running() builds from running, or
+    the VtyshMarkException it raised
+    """
+    running_conf = tmpdir.join('running.conf')
+    running_conf.write(running)
+    monkeypatch.setenv('FAKE_VTYSH_RUNNING', str(running_conf))
+
+    config = frr_reload.Config()
+    result = []
+
+    def load():
+        try:
+            config.load_from_show_running()
+            result.append(config)
+        except frr_reload.VtyshMarkException as e:
+            result.append(e)
+
+    loader = threading.Thread(target=load)
+    loader.daemon = True
+    loader.start()
+    loader.join(30)
+
+    assert not loader.is_alive(), 'load_from_show_running() hung'
+    return result[0]
+
+
+def test_show_running(fake_vtysh, tmpdir, monkeypatch):
+    config = load_from_show_running(tmpdir, monkeypatch, marked_running)
+
+    assert config.digest == make_config(marked_file).digest
+
+
+def test_show_running_mark_error(fake_vtysh, tmpdir, monkeypatch):
+    # vtysh -m gives up while there is still much more than a pipe buffer
+    # of show running left to read
+    running = 'hostname r1\nbogus\n' + 'ip route 10.0.0.0/8 Null0\n' * 100000
+    e = load_from_show_running(tmpdir, monkeypatch, running)
+
+    assert isinstance(e, frr_reload.VtyshMarkException)
+    assert 'Unknown command' in e.output
+
+
+@pytest.mark.parametrize('ctx_keys1, ctx_keys2', [
+    (('interface swp1',), ('interface lo',)),
+    (('interface swp1 vrf red',), ('interface eth0 vrf blue',)),
+    (('router bgp 10',), ('router bgp 4200000000',)),
+    (('router ospf 1',), ('router ospf 2',)),
+    (('router bgp 10', 'address-family ipv4 unicast'),
+     ('router bgp 20', 'address-family ipv4 unicast')),
+    (('route-map FOO permit 10',), ('route-map BAR permit 20',)),
+])
+def test_ctx_node_same(ctx_keys1, ctx_keys2):
+    assert frr_reload.get_ctx_node(ctx_keys1) == frr_reload.get_ctx_node(ctx_keys2)
+
+
+@pytest.mark.parametrize('ctx_keys1, ctx_keys2', [
+    (('router bgp 10', 'address-family ipv4 unicast'),
+     ('router bgp 10', 'address-family ipv6 unicast')),
+    (('router bgp 10', 'address-family ipv4 vpn'),
+     ('router bgp 10', 'address-family ipv6 vpn')),
+    (('mpls ldp', 'address-family ipv4'),
+     ('mpls ldp', 'address-family ipv6')),
+    (('router ospf6',), ('router ospf',)),
+    (('router ospf6',), ('router rip',)),
+])
+def test_ctx_node_different(ctx_keys1, ctx_keys2):
+    assert frr_reload.get_ctx_node(ctx_keys1) != frr_reload.get_ctx_node(ctx_keys2)
+
+
+def test_compare_delete_order():
+    newconf = make_config('''router bgp 10
+ bgp router-id 1.1.1.1
+!
+end
+''')
+    running = make_config('''router bgp 10
+ bgp router-id 1.1.1.1
+ neighbor 1.1.1.2 remote-as 20
+!
+ address-family ipv4 unicast
+  neighbor 1.1.1.2 route-map FOO in
+ exit-address-family
+!
+end
+''')
+
+    # The route-map has to go before the neighbor it is applied to
+    assert frr_reload.compare_context_objects(newconf, running) == ([], [
+        (('router bgp 10', 'address-family ipv4 unicast'), 'neighbor 1.1.1.2 route-map FOO in'),
+        (('router bgp 10',), 'neighbor 1.1.1.2 remote-as 20'),
+    ])
@@ -29,7 +29,8 @@ This program
 """
 
 import argparse
-import copy
+import hashlib
+import itertools
 import logging
 import os
 import random
@@ -37,18 +38,66 @@ import re
 import string
 import subprocess
 import sys
-from collections import OrderedDict
+import threading
 from ipaddr import IPv6Address, IPNetwork
+from multiprocessing.pool import ThreadPool
 from pprint import pformat
 
 
 log = logging.getLogger(__name__)
 
+# the keywords that we know are single line contexts. bgp in this case
+# is not the main router bgp block, but enabling multi-instance
+oneline_ctx_keywords = ("access-list ",
+                        "agentx",
+                        "bgp ",
+                        "debug ",
+                        "dump ",
+                        "enable ",
+                        "frr ",
+                        "hostname ",
+                        "ip ",
+                        "ipv6 ",
+                        "log ",
+                        "mpls",
+                        "no ",
+                        "password ",
+                        "ptm-enable",
+                        "router-id ",
+                        "service ",
+                        "table ",
+                        "username ",
+                        "zebra ")
+
+# Words that could be an IPv6 address or network, anything else with a ':' in
+# it (route-targets, RDs, etc) is not worth handing to ipaddr
+ipv6_word_re = re.compile(r'^[0-9A-Fa-f.]*:[0-9A-Fa-f:.]*:[0-9A-Fa-f.]*(/\d+)?$')
+
+# The same addresses show up many times in a config (bgp neighbors for
+# example) so remember what each word normalized to
+normalized_ipv6_words = {}
+
+# Maps (node, 'no' command that vtysh rejected) to the shorter form of that
+# 'no' command that vtysh accepted, see the OSPF comment in __main__
+no_cmd_cache = {}
+
+# Context key words that get_ctx_node() drops: numbers, addresses, prefixes,
+# RDs, etc.  Keywords such as ipv4, ipv6, ospf6 or l2vpn have a digit in them
+# as well but never match this.
+ctx_node_arg_re = re.compile(r'^[0-9A-Fa-f.:/]*[0-9][0-9A-Fa-f.:/]*$')
+
+# get_ctx_node() also drops the word after each of these, it is a name
+ctx_node_name_keywords = ('chain', 'interface', 'route-map', 'vrf')
+
 
 class VtyshMarkException(Exception):
     pass
 
 
+class VtyshException(Exception):
+    pass
+
+
 class Context(object):
 
     """
@@ -68,24 +117,28 @@ ip forwarding
 
     def __init__(self, keys, lines):
         self.keys = keys
-        self.lines = lines
 
-        # Keep a dictionary of the lines, this is to make it easy to tell if a
+        # newconf and running share most of their lines, interning them means
+        # both Configs share one copy of each line and the dlines lookups in
+        # compare_context_objects can match on identity
+        self.lines = [intern(line) for line in lines]
+
+        # Keep a set of the lines, this is to make it easy to tell if a
         # line exists in this Context
-        self.dlines = OrderedDict()
+        self.dlines = set(self.lines)
 
-        for ligne in lines:
-            self.dlines[ligne] = True
+        # The keys never change so work this out once rather than every
+        # time compare_context_objects looks at this Context
+        self.has_af = any("address-family" in key for key in keys)
 
     def add_lines(self, lines):
         """
         Add lines to specified context
         """
 
+        lines = [intern(line) for line in lines]
         self.lines.extend(lines)
-
-        for ligne in lines:
-            self.dlines[ligne] = True
+        self.dlines.update(lines)
 
 
 class Config(object):
@@ -98,7 +151,12 @@ class Config(object):
 
     def __init__(self):
         self.lines = []
-        self.contexts = OrderedDict()
+        self.contexts = {}
+
+        # The keys of self.contexts in the order they were found in the
+        # config, compare_context_objects needs to walk them in that order
+        self.context_order = []
+        self.digest = None
 
     def load_from_file(self, filename):
         """
@@ -116,7 +174,7 @@ class Config(object):
             ve.output = e.output
             raise ve
 
-        for line in file_output.split('\n'):
+        for line in file_output.splitlines():
             line = line.strip()
 
             # Compress duplicate whitespaces
@@ -128,6 +186,7 @@ class Config(object):
             else:
                 self.lines.append(line)
 
+        self.load_digest()
         self.load_contexts()
 
     def load_from_show_running(self):
@@ -138,16 +197,39 @@ class Config(object):
         """
         log.info('Loading Config object from vtysh show running')
 
-        try:
-            config_text = subprocess.check_output(
-                "/usr/bin/vtysh -c 'show run' | /usr/bin/tail -n +4 | /usr/bin/vtysh -m -f -",
-                shell=True, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            ve = VtyshMarkException(e)
-            ve.output = e.output
-            raise ve
+        # Stream the output rather than reading a (possibly very large)
+        # config into one string first
+        show_cmd = ['/usr/bin/vtysh', '-c', 'show running-config']
+        mark_cmd = ['/usr/bin/vtysh', '-m', '-f', '-']
+        show = subprocess.Popen(show_cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, bufsize=65536)
+        mark = subprocess.Popen(mark_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, bufsize=65536)
+
+        # Skip the 'Building configuration...' banner, vtysh -m would reject it
+        banner = list(itertools.islice(show.stdout, 3))
+
+        def feed_mark():
+            try:
+                for line in show.stdout:
+                    mark.stdin.write(line)
+            except IOError:
+                # vtysh -m exited early, its exit status tells us why.  Keep
+                # reading show running so that it is not left blocked on a
+                # full pipe.
+                for line in show.stdout:
+                    pass
 
-        for line in config_text.split('\n'):
+            try:
+                mark.stdin.close()
+            except IOError:
+                # Closing flushes what is still buffered into the same pipe
+                pass
+
+        feeder = threading.Thread(target=feed_mark)
+        feeder.start()
+
+        for line in mark.stdout:
             line = line.strip()
 
             if (line == 'Building configuration...' or
@@ -157,8 +239,33 @@ class Config(object):
 
             self.lines.append(line)
 
+        feeder.join()
+
+        for (proc, cmd) in ((show, show_cmd), (mark, mark_cmd)):
+            if proc.wait():
+                ve = VtyshMarkException(subprocess.CalledProcessError(proc.returncode, cmd))
+                ve.output = ''.join(banner) + self.get_lines()
+                raise ve
+
+        self.load_digest()
         self.load_contexts()
 
+    def load_digest(self):
+        """
+        Hash the lines that load_contexts() cares about, two Configs with the
+        same digest have nothing to diff
+        """
+
+        lines = [line for line in self.lines
+                 if line and not line.startswith('!') and not line.startswith('#')]
+
+        # vtysh -m always adds an 'end' at the bottom, whether or not the
+        # input (show running for example) already ended with one
+        while lines and lines[-1] == 'end':
+            lines.pop()
+
+        self.digest = hashlib.sha1('\n'.join(lines)).digest()
+
     def get_lines(self):
         """
         Return the lines read in from the configuration
@@ -174,6 +281,14 @@ class Config(object):
         for (_, ctx) in sorted(self.contexts.iteritems()):
             print str(ctx) + '\n'
 
+    def iter_contexts(self):
+        """
+        Yield (key, Context) in the order the contexts appear in the config
+        """
+
+        for key in self.context_order:
+            yield (key, self.contexts[key])
+
     def save_contexts(self, key, lines):
         """
         Save the provided key and lines as a context
@@ -276,18 +391,23 @@ class Config(object):
             key[0] = re.sub(r'\s+null0(\s*$)', ' Null0', key[0])
             key[0] = re.sub(r'\s+blackhole(\s*$)', ' Null0', key[0])
 
+        # key[0] may have been rewritten above so only build the tuple now
+        key = tuple(key)
+
         if lines:
-            if tuple(key) not in self.contexts:
-                ctx = Context(tuple(key), lines)
-                self.contexts[tuple(key)] = ctx
+            if key not in self.contexts:
+                ctx = Context(key, lines)
+                self.contexts[key] = ctx
+                self.context_order.append(key)
             else:
-                ctx = self.contexts[tuple(key)]
+                ctx = self.contexts[key]
                 ctx.add_lines(lines)
 
         else:
-            if tuple(key) not in self.contexts:
-                ctx = Context(tuple(key), [])
-                self.contexts[tuple(key)] = ctx
+            if key not in self.contexts:
+                ctx = Context(key, [])
+                self.contexts[key] = ctx
+                self.context_order.append(key)
 
     def load_contexts(self):
         """
@@ -359,28 +479,9 @@ end
         main_ctx_key = []
         new_ctx = True
 
-        # the keywords that we know are single line contexts. bgp in this case
-        # is not the main router bgp block, but enabling multi-instance
-        oneline_ctx_keywords = ("access-list ",
-                                "agentx",
-                                "bgp ",
-                                "debug ",
-                                "dump ",
-                                "enable ",
-                                "frr ",
-                                "hostname ",
-                                "ip ",
-                                "ipv6 ",
-                                "log ",
-                                "mpls",
-                                "no ",
-                                "password ",
-                                "ptm-enable",
-                                "router-id ",
-                                "service ",
-                                "table ",
-                                "username ",
-                                "zebra ")
+        # This loop runs for every line of the config, check the log level
+        # once rather than inside every log.debug() call
+        debug = log.isEnabledFor(logging.DEBUG)
 
         for line in self.lines:
 
@@ -391,7 +492,7 @@ end
                 continue
 
             # one line contexts
-            if new_ctx is True and any(line.startswith(keyword) for keyword in oneline_ctx_keywords):
+            if new_ctx is True and line.startswith(oneline_ctx_keywords):
                 self.save_contexts(ctx_keys, current_context_lines)
 
                 # Start a new context
@@ -399,13 +500,19 @@ end
                 ctx_keys = [line, ]
                 current_context_lines = []
 
-                log.debug('LINE %-50s: entering new context, %-50s', line, ctx_keys)
+                if debug:
+                    log.debug('LINE %s: entering new context, %s', line, ctx_keys)
                 self.save_contexts(ctx_keys, current_context_lines)
+
+                # A one line context is complete once it is saved, clear the
+                # keys so the next line does not save it a second time
+                ctx_keys = []
                 new_ctx = True
 
             elif line == "end":
                 self.save_contexts(ctx_keys, current_context_lines)
-                log.debug('LINE %-50s: exiting old context, %-50s', line, ctx_keys)
+                if debug:
+                    log.debug('LINE %s: exiting old context, %s', line, ctx_keys)
 
                 # Start a new context
                 new_ctx = True
@@ -419,20 +526,22 @@ end
                     self.save_contexts(ctx_keys, current_context_lines)
 
                     # Start a new context
-                    ctx_keys = copy.deepcopy(main_ctx_key)
+                    ctx_keys = list(main_ctx_key)
                     current_context_lines = []
-                    log.debug('LINE %-50s: popping from subcontext to ctx%-50s', line, ctx_keys)
+                    if debug:
+                        log.debug('LINE %s: popping from subcontext to ctx %s', line, ctx_keys)
 
             elif new_ctx is True:
                 if not main_ctx_key:
                     ctx_keys = [line, ]
                 else:
-                    ctx_keys = copy.deepcopy(main_ctx_key)
+                    ctx_keys = list(main_ctx_key)
                     main_ctx_key = []
 
                 current_context_lines = []
                 new_ctx = False
-                log.debug('LINE %-50s: entering new context, %-50s', line, ctx_keys)
+                if debug:
+                    log.debug('LINE %s: entering new context, %s', line, ctx_keys)
             elif (line.startswith("address-family ") or
                   line.startswith("vnc defaults") or
                   line.startswith("vnc l2-group") or
@@ -446,8 +555,9 @@ end
                 # Save old context first
                 self.save_contexts(ctx_keys, current_context_lines)
                 current_context_lines = []
-                main_ctx_key = copy.deepcopy(ctx_keys)
-                log.debug('LINE %-50s: entering sub-context, append to ctx_keys', line)
+                main_ctx_key = list(ctx_keys)
+                if debug:
+                    log.debug('LINE %s: entering sub-context, append to ctx_keys', line)
 
                 if line == "address-family ipv6":
                     ctx_keys.append("address-family ipv6 unicast")
@@ -461,7 +571,8 @@ end
             else:
                 # Continuing in an existing context, add non-commented lines to it
                 current_context_lines.append(line)
-                log.debug('LINE %-50s: append to current_context_lines, %-50s', line, ctx_keys)
+                if debug:
+                    log.debug('LINE %s: append to current_context_lines, %s', line, ctx_keys)
 
         # Save the context of the last one
         self.save_contexts(ctx_keys, current_context_lines)
@@ -469,51 +580,41 @@ end
 
 def line_to_vtysh_conft(ctx_keys, line, delete):
     """
-    Return the vtysh command for the specified context line
+    Return the commands, as they would be typed into vtysh from within
+    'configure terminal', for the specified context line
     """
 
-    cmd = []
-    cmd.append('vtysh')
-    cmd.append('-c')
-    cmd.append('conf t')
-
     if line:
-        for ctx_key in ctx_keys:
-            cmd.append('-c')
-            cmd.append(ctx_key)
-
+        cmd = list(ctx_keys)
         line = line.lstrip()
 
         if delete:
-            cmd.append('-c')
-
             if line.startswith('no '):
                 cmd.append('%s' % line[3:])
             else:
                 cmd.append('no %s' % line)
 
         else:
-            cmd.append('-c')
             cmd.append(line)
 
     # If line is None then we are typically deleting an entire
     # context ('no router ospf' for example)
     else:
 
+        cmd = []
+
         if delete:
+            last = len(ctx_keys) - 1
 
             # Only put the 'no' on the last sub-context
-            for ctx_key in ctx_keys:
-                cmd.append('-c')
+            for (i, ctx_key) in enumerate(ctx_keys):
 
-                if ctx_key == ctx_keys[-1]:
+                if i == last:
                     cmd.append('no %s' % ctx_key)
                 else:
                     cmd.append('%s' % ctx_key)
         else:
-            for ctx_key in ctx_keys:
-                cmd.append('-c')
-                cmd.append(ctx_key)
+            cmd.extend(ctx_keys)
 
     return cmd
 
@@ -544,11 +645,12 @@ def line_for_vtysh_file(ctx_keys, line, delete):
     # context ('no router ospf' for example)
     else:
         if delete:
+            last = len(ctx_keys) - 1
 
             # Only put the 'no' on the last sub-context
-            for ctx_key in ctx_keys:
+            for (i, ctx_key) in enumerate(ctx_keys):
 
-                if ctx_key == ctx_keys[-1]:
+                if i == last:
                     cmd.append('no %s' % ctx_key)
                 else:
                     cmd.append('%s' % ctx_key)
@@ -567,6 +669,27 @@ def line_for_vtysh_file(ctx_keys, line, delete):
     return cmd
 
 
+def get_normalized_ipv6_word(word):
+    """
+    Return a normalized IPv6 address or network as produced by frr
+    """
+    norm_word = None
+
+    if "/" in word:
+        try:
+            v6word = IPNetwork(word)
+            norm_word = '%s/%s' % (v6word.network, v6word.prefixlen)
+        except ValueError:
+            pass
+    if not norm_word:
+        try:
+            norm_word = '%s' % IPv6Address(word)
+        except ValueError:
+            norm_word = word
+
+    return norm_word
+
+
 def get_normalized_ipv6_line(line):
     """
     Return a normalized IPv6 line as produced by frr,
@@ -574,27 +697,20 @@ def get_normalized_ipv6_line(line):
     zeros removed, and only the network portion present if
     the IPv6 word is a network
     """
-    norm_line = ""
+    norm_words = []
     words = line.split(' ')
     for word in words:
-        if ":" in word:
-            norm_word = None
-            if "/" in word:
-                try:
-                    v6word = IPNetwork(word)
-                    norm_word = '%s/%s' % (v6word.network, v6word.prefixlen)
-                except ValueError:
-                    pass
-            if not norm_word:
-                try:
-                    norm_word = '%s' % IPv6Address(word)
-                except ValueError:
-                    norm_word = word
+        if ":" in word and ipv6_word_re.match(word):
+            norm_word = normalized_ipv6_words.get(word)
+
+            if norm_word is None:
+                norm_word = get_normalized_ipv6_word(word)
+                normalized_ipv6_words[word] = norm_word
         else:
             norm_word = word
-        norm_line = norm_line + " " + norm_word
+        norm_words.append(norm_word)
 
-    return norm_line.strip()
+    return ' '.join(norm_words)
 
 
 def line_exist(lines, target_ctx_keys, target_line, exact_match=True):
@@ -907,9 +1023,14 @@ def compare_context_objects(newconf, running):
     lines_to_del = []
     delete_bgpd = False
 
-    # Find contexts that are in newconf but not in running
+    # The lines of contexts that are in both go ahead of the whole contexts
+    # that are only in newconf when adding, and after the whole contexts that
+    # are only in running when deleting
+    new_ctx_lines_to_add = []
+    shared_ctx_lines_to_del = []
+
     # Find contexts that are in running but not in newconf
-    for (running_ctx_keys, running_ctx) in running.contexts.iteritems():
+    for (running_ctx_keys, running_ctx) in running.iter_contexts():
 
         if running_ctx_keys not in newconf.contexts:
 
@@ -947,7 +1068,7 @@ def compare_context_objects(newconf, running):
                     lines_to_del.append((running_ctx_keys, line))
 
             # Non-global context
-            elif running_ctx_keys and not any("address-family" in key for key in running_ctx_keys):
+            elif running_ctx_keys and not running_ctx.has_af:
                 lines_to_del.append((running_ctx_keys, None))
 
             elif running_ctx_keys and not any("vni" in key for key in running_ctx_keys):
@@ -958,9 +1079,10 @@ def compare_context_objects(newconf, running):
                 for line in running_ctx.lines:
                     lines_to_del.append((running_ctx_keys, line))
 
+    # Find contexts that are in newconf but not in running
     # Find the lines within each context to add
     # Find the lines within each context to del
-    for (newconf_ctx_keys, newconf_ctx) in newconf.contexts.iteritems():
+    for (newconf_ctx_keys, newconf_ctx) in newconf.iter_contexts():
 
         if newconf_ctx_keys in running.contexts:
             running_ctx = running.contexts[newconf_ctx_keys]
@@ -971,15 +1093,16 @@ def compare_context_objects(newconf, running):
 
             for line in running_ctx.lines:
                 if line not in newconf_ctx.dlines:
-                    lines_to_del.append((newconf_ctx_keys, line))
+                    shared_ctx_lines_to_del.append((newconf_ctx_keys, line))
 
-    for (newconf_ctx_keys, newconf_ctx) in newconf.contexts.iteritems():
-
-        if newconf_ctx_keys not in running.contexts:
-            lines_to_add.append((newconf_ctx_keys, None))
+        else:
+            new_ctx_lines_to_add.append((newconf_ctx_keys, None))
 
             for line in newconf_ctx.lines:
-                lines_to_add.append((newconf_ctx_keys, line))
+                new_ctx_lines_to_add.append((newconf_ctx_keys, line))
+
+    lines_to_add.extend(new_ctx_lines_to_add)
+    lines_to_del.extend(shared_ctx_lines_to_del)
 
     (lines_to_add, lines_to_del) = ignore_delete_re_add_lines(lines_to_add, lines_to_del)
     (lines_to_add, lines_to_del) = ignore_unconfigurable_lines(lines_to_add, lines_to_del)
@@ -988,6 +1111,30 @@ def compare_context_objects(newconf, running):
 
 
 
+def get_ctx_node(ctx_keys):
+    """
+    Return a key that is the same for contexts that put vtysh in the same
+    node, 'interface swp1' and 'interface swp2' for example.  Only numbers,
+    addresses and names are dropped, every keyword is kept so that
+    'address-family ipv4 unicast' and 'address-family ipv6 unicast' stay
+    apart.
+    """
+    node = []
+
+    for ctx_key in ctx_keys:
+        words = []
+        prev_word = None
+
+        for word in ctx_key.split():
+            if prev_word not in ctx_node_name_keywords and not ctx_node_arg_re.match(word):
+                words.append(word)
+            prev_word = word
+
+        node.append(' '.join(words))
+
+    return tuple(node)
+
+
 def vtysh_config_available():
     """
     Return False if no frr daemon is running or some other vtysh session is
@@ -1013,6 +1160,140 @@ def vtysh_config_available():
     return True
 
 
+class Vtysh(object):
+
+    """
+    A single interactive vtysh process that commands are streamed to over
+    stdin.  vtysh builds its entire command graph every time it starts so
+    running one of these per reload is much cheaper than running a
+    'vtysh -c' per line.
+    """
+
+    # configure() results
+    SUCCESS = 0
+
+    # The daemon accepted the command but printed something, vtysh -c
+    # treats this (CMD_WARNING) as success
+    WARNING = 1
+
+    # vtysh could not parse the command
+    SYNTAX_ERROR = 2
+
+    # One of the context keys could not be entered
+    CTX_ERROR = 3
+
+    # vtysh answers this with '% Unknown command: frr-reload-sync', once we
+    # have read that back we know we have all of the output for the command
+    # that was sent before it
+    sync = 'frr-reload-sync'
+
+    # readline may write one or more prompts ahead of a line of output
+    prompt_re = re.compile(r'^(\S+# )+')
+
+    # vtysh prints these itself when it cannot parse a command
+    syntax_errors = ('% Unknown command:',
+                     '% Ambiguous command:',
+                     '% Command incomplete:')
+
+    def __init__(self):
+        # readline wraps its echo of any line longer than the screen with
+        # escape sequences, which run() would then take for output.  With
+        # stdin not a tty it gets the width from COLUMNS, or assumes 80.
+        env = dict(os.environ, COLUMNS='100000', TERM='dumb')
+        self.proc = subprocess.Popen(['/usr/bin/vtysh'],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT,
+                                     bufsize=65536,
+                                     env=env)
+
+        # Read past the greeting vtysh prints when it starts
+        self.run('')
+
+        # Otherwise vtysh pipes the output of every command it sends to a
+        # daemon through a freshly started pager
+        self.run('terminal length 0')
+
+    def run(self, cmd):
+        """
+        Send a single cmd to vtysh and return the lines it printed for it
+        """
+        self.proc.stdin.write('%s\n%s\n' % (cmd, self.sync))
+        self.proc.stdin.flush()
+
+        sync_output = '%% Unknown command: %s' % self.sync
+        output = []
+
+        while True:
+            line = self.proc.stdout.readline()
+
+            if not line:
+                raise VtyshException('vtysh exited unexpectedly\n%s' % '\n'.join(output))
+
+            line = self.prompt_re.sub('', line.rstrip())
+
+            if line == sync_output:
+                break
+
+            # readline echoes back the lines it reads
+            if line and line != cmd and line != self.sync:
+                output.append(line)
+
+        return output
+
+    def configure(self, cmds):
+        """
+        From within 'configure terminal' enter each context key in cmds[:-1]
+        and then run cmds[-1].  Return a (status, output) tuple for the last
+        command, or for the context key that could not be entered in which
+        case the last command is not run.  We 'end' afterwards so that the
+        configuration lock is not held in between calls.
+        """
+        try:
+            # Entering a context prints nothing when it works
+            for ctx_key in ['configure terminal'] + cmds[:-1]:
+                output = self.run(ctx_key)
+
+                if output:
+                    return (self.CTX_ERROR, '\n'.join(output))
+
+            output = self.run(cmds[-1])
+        finally:
+            self.run('end')
+
+        if any(line.startswith(self.syntax_errors) for line in output):
+            status = self.SYNTAX_ERROR
+        elif output:
+            status = self.WARNING
+        else:
+            status = self.SUCCESS
+
+        return (status, '\n'.join(output))
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+def load_configs(loads):
+    """
+    Run each (load_from_* method, args) in loads at the same time. They
+    spend most of their time waiting on vtysh so they overlap well in
+    threads.
+    """
+    pool = ThreadPool(len(loads))
+
+    try:
+        results = [pool.apply_async(load, load_args) for (load, load_args) in loads]
+
+        # get() re-raises any exception, VtyshMarkException for example
+        for result in results:
+            result.get()
+    finally:
+        pool.close()
+        pool.join()
+
+
 if __name__ == '__main__':
     # Command line options
     parser = argparse.ArgumentParser(description='Dynamically apply diff in frr configs')
@@ -1087,22 +1368,30 @@ if __name__ == '__main__':
 
     log.info('Called via "%s"', str(args))
 
-    # Create a Config object from the config generated by newconf
+    # We will not be able to do anything, go ahead and exit(1). Check this
+    # before loading the running config which needs the daemons as well.
+    if args.reload and not vtysh_config_available():
+        sys.exit(1)
+
+    # Create a Config object from the config generated by newconf and
+    # another from the running config
     newconf = Config()
-    newconf.load_from_file(args.filename)
+    running = Config()
+
+    if args.test and args.input:
+        load_running = (running.load_from_file, (args.input,))
+    else:
+        load_running = (running.load_from_show_running, ())
+
+    load_configs([(newconf.load_from_file, (args.filename,)), load_running])
     reload_ok = True
 
     if args.test:
 
-        # Create a Config object from the running config
-        running = Config()
-
-        if args.input:
-            running.load_from_file(args.input)
+        if newconf.digest == running.digest:
+            (lines_to_add, lines_to_del) = ([], [])
         else:
-            running.load_from_show_running()
-
-        (lines_to_add, lines_to_del) = compare_context_objects(newconf, running)
+            (lines_to_add, lines_to_del) = compare_context_objects(newconf, running)
         lines_to_configure = []
 
         if lines_to_del:
@@ -1133,11 +1422,9 @@ if __name__ == '__main__':
 
     elif args.reload:
 
-        # We will not be able to do anything, go ahead and exit(1)
-        if not vtysh_config_available():
-            sys.exit(1)
-
-        log.debug('New Frr Config\n%s', newconf.get_lines())
+        # get_lines() joins the whole config, only do that if it will be logged
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('New Frr Config\n%s', newconf.get_lines())
 
         # This looks a little odd but we have to do this twice...here is why
         # If the user had this running bgp config:
@@ -1177,9 +1464,18 @@ if __name__ == '__main__':
         lines_to_add_first_pass = []
 
         for x in range(2):
-            running = Config()
-            running.load_from_show_running()
-            log.debug('Running Frr Config (Pass #%d)\n%s', x, running.get_lines())
+
+            # The running config for the first pass was loaded above
+            if x > 0:
+                running = Config()
+                running.load_from_show_running()
+
+            elif newconf.digest == running.digest:
+                log.info('Running config already matches %s', args.filename)
+                break
+
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Running Frr Config (Pass #%d)\n%s', x, running.get_lines())
 
             (lines_to_add, lines_to_del) = compare_context_objects(newconf, running)
 
@@ -1202,6 +1498,8 @@ if __name__ == '__main__':
             # apply to other scenarios as well where configuring FOO adds BAR
             # to the config.
             if lines_to_del and x == 0:
+                vtysh = Vtysh()
+
                 for (ctx_keys, line) in lines_to_del:
 
                     if line == '!':
@@ -1211,12 +1509,13 @@ if __name__ == '__main__':
                     # vtysh -f that file. See the next comment for an explanation
                     # of their quirks
                     cmd = line_to_vtysh_conft(ctx_keys, line, True)
-                    original_cmd = cmd
+                    original_cmd = list(cmd)
 
                     # Some commands in frr are picky about taking a "no" of the entire line.
                     # OSPF is bad about this, you can't "no" the entire line, you have to "no"
-                    # only the beginning. If we hit one of these command an exception will be
-                    # thrown.  Catch it and remove the last '-c', 'FOO' from cmd and try again.
+                    # only the beginning. If we hit one of these commands vtysh will
+                    # print an error.  Remove the last word from the last entry in cmd and
+                    # try again.
                     #
                     # Example:
                     # frr(config-if)# ip ospf authentication message-digest 1.1.1.1
@@ -1226,30 +1525,69 @@ if __name__ == '__main__':
                     #  % Unknown command.
                     # frr(config-if)# no ip ospf authentication
                     # frr(config-if)#
+                    #
+                    # The same line often shows up in many contexts (every interface
+                    # running OSPF for example) so once we know which form vtysh
+                    # accepted we start with that form for the other contexts. Only
+                    # syntax errors lead to a shorter form, state dependent errors
+                    # from the daemon could differ from one context to the next.
+                    no_cmd_key = (get_ctx_node(cmd[:-1]), cmd[-1])
+                    use_cached = no_cmd_key in no_cmd_cache
+
+                    if use_cached:
+                        cmd[-1] = no_cmd_cache[no_cmd_key]
 
                     while True:
-                        try:
-                            _ = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+                        (status, output) = vtysh.configure(cmd)
+
+                        if status == Vtysh.CTX_ERROR:
+                            # vtysh -c would have stopped here as well, running the
+                            # "no" anyway could apply it in the parent node instead
+                            log.error('"%s" we failed to enter the context for this command\n%s',
+                                      ' -> '.join(original_cmd), output)
+                            break
+
+                        elif status != Vtysh.SUCCESS and use_cached:
+                            # This context must not be the same node after all,
+                            # start over with the full command
+                            log.info('Failed to execute %s', ' -> '.join(cmd))
+                            cmd = list(original_cmd)
+                            use_cached = False
 
-                        except subprocess.CalledProcessError:
+                        elif status == Vtysh.SYNTAX_ERROR:
 
                             # - Pull the last entry from cmd (this would be
                             #   'no ip ospf authentication message-digest 1.1.1.1' in
                             #   our example above
                             # - Split that last entry by whitespace and drop the last word
-                            log.info('Failed to execute %s', ' '.join(cmd))
+                            log.info('Failed to execute %s', ' -> '.join(cmd))
                             last_arg = cmd[-1].split(' ')
 
                             if len(last_arg) <= 2:
-                                log.error('"%s" we failed to remove this command', original_cmd)
+                                log.error('"%s" we failed to remove this command', ' -> '.join(original_cmd))
                                 break
 
                             new_last_arg = last_arg[0:-1]
                             cmd[-1] = ' '.join(new_last_arg)
                         else:
-                            log.info('Executed "%s"', ' '.join(cmd))
+                            # The daemon understood the command, if it had
+                            # something to say about it do not go on to try a
+                            # shorter (broader) "no" form
+                            if status == Vtysh.WARNING:
+                                log.warning('"%s" returned\n%s', ' -> '.join(cmd), output)
+                            else:
+                                log.info('Executed "%s"', ' -> '.join(cmd))
+
+                            # We only get here with a shorter form after vtysh
+                            # rejected the longer ones as syntax errors, which is
+                            # the same for every context in this node.  Do not
+                            # cache a form the daemon had something to say about.
+                            if status == Vtysh.SUCCESS and cmd[-1] != original_cmd[-1]:
+                                no_cmd_cache[no_cmd_key] = cmd[-1]
                             break
 
+                vtysh.close()
+
             if lines_to_add:
                 lines_to_configure = []
 
@@ -1280,6 +1618,12 @@ if __name__ == '__main__':
                         reload_ok = False
                     os.unlink(filename)
 
+            # The second pass is only there to put back lines that a "no"
+            # on the first pass removed as a side effect. If the first pass
+            # did not delete anything there is nothing to put back.
+            if x == 0 and not lines_to_del:
+                break
+
         # Make these changes persistent
         if args.overwrite or args.filename != '/etc/frr/frr.conf':
             subprocess.call(['/usr/bin/vtysh', '-c', 'write'])